@@ -1,352 +1,1200 @@
-import streamlit as st
-from typing import Dict, List
-import anthropic
-import json
-import webbrowser
-import hmac
-from supabase import create_client
-import random
-
-def check_password():
-    """Returns `True` if the user had the correct password."""
-
-    def password_entered():
-        """Checks whether a password entered by the user is correct."""
-        if hmac.compare_digest(st.session_state["password"], st.secrets["PASSWORD"]):
-            st.session_state["password_correct"] = True
-            del st.session_state["password"]  # Remove password from session state
-        else:
-            st.session_state["password_correct"] = False
-
-    # First run or password not yet entered
-    if "password_correct" not in st.session_state:
-        st.text_input(
-            "Password", 
-            type="password", 
-            on_change=password_entered, 
-            key="password"
-        )
-        return False
-    
-    # Password already entered and correct
-    elif st.session_state["password_correct"]:
-        return True
-    
-    # Password entered but incorrect
-    else:
-        st.text_input(
-            "Password", 
-            type="password", 
-            on_change=password_entered, 
-            key="password"
-        )
-        st.error("😕 Password incorrect")
-        return False
-
-class SQLTrainer:
-    def __init__(self):
-        # Check for required secrets
-        required_secrets = ['ANTHROPIC_API_KEY', 'SUPABASE_URL', 'SUPABASE_KEY']
-        missing_secrets = [secret for secret in required_secrets if secret not in st.secrets]
-        if missing_secrets:
-            raise RuntimeError(f"Missing required secrets: {', '.join(missing_secrets)}")
-            
-        self.client = anthropic.Anthropic(api_key=st.secrets["ANTHROPIC_API_KEY"])
-        self.supabase = create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
-        self.industry_schemas: Dict[str, Dict] = {
-            "logistics": {
-                "schema_url": "https://claude.site/artifacts/98ddf448-03e9-496c-928a-48d0604d4759", 
-                "tables": {
-                    "products": ["product_id", "sku", "name", "description", "category", "unit_weight", "unit_volume", "base_price", "minimum_stock", "is_active"],
-                    "warehouses": ["warehouse_id", "name", "address", "city", "state", "zip_code", "total_capacity", "temperature_controlled", "operating_hours", "status"],
-                    "zones": ["zone_id", "warehouse_id", "zone_name", "zone_type", "capacity", "temperature_range"],
-                    "inventory": ["inventory_id", "product_id", "warehouse_id", "zone_id", "quantity", "lot_number", "expiration_date", "last_counted_date"],
-                    "suppliers": ["supplier_id", "name", "contact_person", "email", "phone", "address", "payment_terms", "rating", "active"],
-                    "purchase_orders": ["po_id", "supplier_id", "warehouse_id", "order_date", "expected_delivery", "status", "total_amount"],
-                    "po_items": ["po_item_id", "po_id", "product_id", "quantity", "unit_price"],
-                    "employees": ["employee_id", "first_name", "last_name", "email", "phone", "role", "warehouse_id", "hire_date", "certification"],
-                    "shipments": ["shipment_id", "warehouse_id", "destination_address", "carrier", "tracking_number", "status", "ship_date", "estimated_delivery", "actual_delivery"],
-                    "shipment_items": ["shipment_item_id", "shipment_id", "product_id", "quantity", "picked_by", "picked_from_zone"]
-                },
-                "relationships": [
-                    "zones.warehouse_id -> warehouses.warehouse_id",
-                    "inventory.product_id -> products.product_id",
-                    "inventory.warehouse_id -> warehouses.warehouse_id",
-                    "inventory.zone_id -> zones.zone_id",
-                    "purchase_orders.supplier_id -> suppliers.supplier_id",
-                    "purchase_orders.warehouse_id -> warehouses.warehouse_id",
-                    "po_items.po_id -> purchase_orders.po_id",
-                    "po_items.product_id -> products.product_id",
-                    "employees.warehouse_id -> warehouses.warehouse_id",
-                    "shipments.warehouse_id -> warehouses.warehouse_id",
-                    "shipment_items.shipment_id -> shipments.shipment_id",
-                    "shipment_items.product_id -> products.product_id",
-                    "shipment_items.picked_by -> employees.employee_id",
-                    "shipment_items.picked_from_zone -> zones.zone_id"
-                ]
-            },
-            "healthcare": {
-                "schema_url": "https://claude.site/artifacts/96e82497-f107-4e25-97c1-220b727b1c3b",
-                "tables": {
-                    "patients": ["patient_id", "name", "dob", "insurance_id"],
-                    "appointments": ["appointment_id", "patient_id", "doctor_id", "date", "status"],
-                    "doctors": ["doctor_id", "name", "specialty", "department"],
-                    "treatments": ["treatment_id", "patient_id", "doctor_id", "diagnosis", "date"]
-                },
-                "relationships": [
-                    "appointments.patient_id -> patients.patient_id",
-                    "appointments.doctor_id -> doctors.doctor_id",
-                    "treatments.patient_id -> patients.patient_id"
-                ]
-            }
-        }
-        self.question_topics = {
-        "logistics": {
-            "inventory_analysis": {
-                "focus": ["current stock levels", "reorder points", "product availability", "inventory by warehouse"],
-                "metrics": ["total quantity", "number of products", "storage utilization", "low stock items"]
-            },
-            "warehouse_operations": {
-                "focus": ["zone usage", "warehouse capacity", "temperature controlled storage", "warehouse status"],
-                "metrics": ["total capacity", "available space", "zone distribution", "facility utilization"]
-            },
-            "supplier_insights": {
-                "focus": ["supplier performance", "order status", "delivery tracking", "supplier ratings"],
-                "metrics": ["active suppliers", "pending orders", "order volumes", "supplier ratings"]
-            },
-            "shipping_status": {
-                "focus": ["current shipments", "carrier usage", "delivery performance", "shipping volume"],
-                "metrics": ["active shipments", "items shipped", "shipping capacity", "delivery status"]
-            }
-        }
-    }
-    def get_schema_prompt(self, industry: str) -> str:
-        """Creates a detailed prompt describing the database schema"""
-        schema = self.industry_schemas.get(industry)
-        if not schema:
-            return "Industry not found"
-            
-        prompt = f"Database Schema for {industry.title()}:\n\n"
-        
-        # Add tables
-        prompt += "Tables:\n"
-        for table, columns in schema["tables"].items():
-            prompt += f"- {table} ({', '.join(columns)})\n"
-        
-        # Add relationships
-        prompt += "\nRelationships:\n"
-        for rel in schema["relationships"]:
-            prompt += f"- {rel}\n"
-            
-        return prompt
-
-    def generate_stakeholder_question(self, industry: str) -> str:
-        """Generates a business question using Claude"""
-        schema_prompt = self.get_schema_prompt(industry)
-        
-        # Get random topic and its details
-        if industry not in self.question_topics:
-            return "Industry not supported for question generation"
-            
-        topic = random.choice(list(self.question_topics[industry].keys()))
-        topic_details = self.question_topics[industry][topic]
-        
-        prompt = f"""
-            {schema_prompt}
-        
-            You are a business stakeholder in the {industry} industry who needs data for analysis.
-            Generate ONE business question that can be answered with SQL.
-            
-            Topic area: {topic}
-            Focus on: {random.choice(topic_details['focus'])}
-            Key metric: {random.choice(topic_details['metrics'])}
-            
-            Requirements:
-            - Question must be specific and actionable
-            - Query should require at most 1 JOIN
-            - Can use basic aggregations (SUM, COUNT, MIN, MAX)
-            - Must be answerable using the schema provided
-            - Focus on practical business insights
-            
-            Format your response as:
-            "I need a report showing [specific metric] for [specific business purpose]."
-        """
-        
-        response = self.client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=150,
-            temperature=0.7,
-            system="You are a business stakeholder asking for data.",
-            messages=[
-                {
-                    "role": "user", 
-                    "content": prompt
-                }
-            ]
-        )
-        
-        return response.content[0].text
-
-    def validate_sql(self, query: str, industry: str, question: str) -> Dict:
-        """Validates the SQL query using Claude"""
-        schema_prompt = self.get_schema_prompt(industry)
-        
-        prompt = f"""
-        {schema_prompt}
-    
-        The stakeholder asked: "{question}"
-        
-        The user provided this SQL query:
-        {query}
-        
-        Please analyze if this query correctly answers the question. The query should follow PostgressSQL syntax. Provide:
-        1. Whether the query is correct (yes/no)
-        2. Specific feedback about what's right or wrong
-        3. A hint if the query needs improvement
-        4. The correct query if the user's query is wrong.
-        """
-        
-        response = self.client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=500,
-            temperature=0,
-            system="You are a SQL expert providing feedback.",
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        )
-        
-        feedback = response.content[0].text
-        
-        # Parse the response into parts
-        is_correct = "yes" in feedback.lower().split("\n")[0]
-        
-        return {
-            "is_correct": is_correct,
-            "feedback": feedback,
-            "hint": feedback if not is_correct else "",
-            "correct_query": feedback if not is_correct else query
-        }
-    
-    def execute_query(self, query: str) -> Dict:
-        """Executes the SQL query against Supabase database"""
-        try:
-            # Remove trailing semicolon and whitespace
-            cleaned_query = query.strip().rstrip(';')
-            
-            result = self.supabase.rpc('execute_query', {'query_text': cleaned_query}).execute()
-            return {
-                "success": True,
-                "data": result.data,
-                "error": None
-            }
-        except Exception as e:
-            return {
-                "success": False,
-                "data": None,
-                "error": str(e)
-            }
-
-def main():
-    st.set_page_config(layout="wide")
-    
-    if not check_password():
-        st.stop()  # Do not continue if check_password is False
-    
-    try:
-        trainer = SQLTrainer()
-    except RuntimeError as e:
-        st.error(f"Error: {str(e)}")
-        return
-    
-    # Initialize session state
-    if 'industry' not in st.session_state:
-        st.session_state.industry = None
-        st.session_state.current_question = None
-    
-    st.title("SQL Trainer")
-    
-    # Industry selection (only shown at start)
-    if not st.session_state.industry:
-        st.header("Select Industry 🏭")
-        industry = st.selectbox(
-            "What industry do you work in?",
-            list(trainer.industry_schemas.keys())
-        )
-        if st.button("Start Training ▶️"):
-            st.session_state.industry = industry
-            st.rerun()
-    else:
-        col1, col2 = st.columns([2, 1])
-        
-        with col1:
-            # Generate new question with loading spinner
-            if st.button("Get New Question 🎯") or not st.session_state.current_question:
-                with st.spinner('Generating new question... 🤔'):
-                    st.session_state.current_question = trainer.generate_stakeholder_question(
-                        st.session_state.industry
-                    )
-            
-            st.write("### Question 📋")
-            st.info(st.session_state.current_question)
-            
-            # SQL input
-            user_query = st.text_area("Your SQL Query: ⌨️", height=150)
-            
-            # Create two columns for the buttons
-            button_col1, button_col2 = st.columns(2)
-            
-            with button_col1:
-                if st.button("Submit for Validation 🔍"):
-                    if user_query:
-                        with st.spinner('Analyzing your SQL code... 🔍'):
-                            feedback = trainer.validate_sql(
-                                user_query,
-                                st.session_state.industry,
-                                st.session_state.current_question
-                            )
-                        
-                        if feedback["is_correct"]:
-                            st.success("🎉 " + feedback["feedback"])
-                        else:
-                            st.error("❌ " + feedback["feedback"])
-            
-            with button_col2:
-                if st.button("Query Database 📊"):
-                    if user_query:
-                        with st.spinner('Executing query... 🔄'):
-                            result = trainer.execute_query(user_query)
-                            
-                            if result["success"]:
-                                st.write("### Query Results")
-                                st.dataframe(result["data"])
-                            else:
-                                st.error(f"Query Error: {result['error']}")
-        
-        with col2:
-            st.header("Help")
-            
-            # Change Industry button
-            if st.button("Change Industry 🔄"):
-                st.session_state.industry = None
-                st.session_state.current_question = None
-                st.rerun()
-            
-            # Add link button to view schema URL in new tab
-            schema_url = trainer.industry_schemas[st.session_state.industry]["schema_url"]
-            st.link_button("View Database Schema 📊", schema_url)
-            
-            st.write("### Tips 💡")
-            st.write("""
-            - 🔗 Make sure to include all necessary JOINs
-            - 🎯 Remember to use appropriate WHERE clauses
-            - 📊 Consider using aggregations when needed
-            - 🚀 Use 'Submit for Validation' to check your query
-            - 🔍 Use 'Query Database' to see actual results
-            """)
-
-if __name__ == "__main__":
-    main()
+import streamlit as st
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional
+import asyncio
+import httpx
+import collections
+import concurrent.futures
+import functools
+import gc
+import hashlib
+import io
+import pyarrow as pa
+import pyarrow.csv
+import sqlglot
+import orjson
+import re
+import textwrap
+import threading
+import time
+import hmac
+import random
+
+# Size the pre-generated question pool is refilled to, and the level at
+# which a background refill is kicked off
+QUESTION_POOL_SIZE = 20
+QUESTION_POOL_REFILL_AT = 5
+
+# Question generation is a one-sentence task, so it runs on Haiku for
+# latency and cost; validation keeps Sonnet for reasoning quality
+GENERATION_MODEL = "claude-3-5-haiku-latest"
+VALIDATION_MODEL = "claude-3-5-sonnet-latest"
+
+# The requested format is a single sentence, so 80 tokens is plenty
+GENERATION_MAX_TOKENS = 80
+VALIDATION_MAX_TOKENS = 400
+VALIDATION_CONTEXT_BUDGET = 4000
+RETRY_MAX_ATTEMPTS = 5
+RETRY_MAX_SLEEP_SECONDS = 30.0
+GC_COLLECT_EVERY_N_RERUNS = 25
+
+# Reruns allocate enough dicts/strings/widget objects to trigger cyclic
+# GC mid-render; collection is scheduled explicitly from main() instead
+gc.disable()
+
+# Pulls the first JSON object out of a response that wraps it in prose
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+# Splits a numbered list of generated questions into individual items
+_NUMBERED_LINE_RE = re.compile(r"^\s*\d+[.)]\s*(.+)$", re.MULTILINE)
+
+# JSON inside a fenced code block, despite the no-fences instruction
+_FENCED_JSON_RE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+_BASIC_SQL_RE = re.compile(r"\bSELECT\b.+?\bFROM\b", re.IGNORECASE | re.DOTALL)
+
+# Forced tool call for validation: the model can only answer by filling
+# this schema, so the response is guaranteed-parseable — no JSON
+# salvaging from prose or code fences
+_VALIDATION_TOOL = {
+    "name": "report_validation",
+    "description": "Report whether the submitted SQL query correctly answers the stakeholder's question.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "is_correct": {"type": "boolean"},
+            "feedback": {"type": "string", "description": "What's right or wrong with the query"},
+            "hint": {"type": "string", "description": "Hint if the query needs improvement, else empty"},
+            "correct_query": {"type": "string", "description": "The correct query if the user's query is wrong, else empty"}
+        },
+        "required": ["is_correct", "feedback"]
+    }
+}
+
+TIPS_MD = """
+- 🔗 Make sure to include all necessary JOINs
+- 🎯 Remember to use appropriate WHERE clauses
+- 📊 Consider using aggregations when needed
+- 🚀 Use 'Submit for Validation' to check your query
+- 🔍 Use 'Query Database' to see actual results
+"""
+
+def _approx_tokens(text: str) -> int:
+    """Cheap ~4-chars-per-token estimate, good enough for budgeting"""
+    return len(text) // 4
+
+def _is_retryable(exc) -> bool:
+    # 429 bursts and transient overloads; anything else is a real error
+    return getattr(exc, "status_code", None) in (429, 500, 529)
+
+def _retry_delay(exc, attempt: int) -> float:
+    """Honors a Retry-After header when present, otherwise exponential
+    backoff with jitter so concurrent sessions don't retry in lockstep"""
+    response = getattr(exc, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), RETRY_MAX_SLEEP_SECONDS)
+            except ValueError:
+                pass
+    return min(2 ** attempt + random.random(), RETRY_MAX_SLEEP_SECONDS)
+
+def _call_with_retry(fn, *args, **kwargs):
+    """Retries transient Anthropic failures instead of ending the
+    user's turn on a burst 429. RateLimitError subclasses
+    APIStatusError, so one except covers both."""
+    import anthropic
+
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        try:
+            return fn(*args, **kwargs)
+        except anthropic.APIStatusError as e:
+            if not _is_retryable(e) or attempt == RETRY_MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(_retry_delay(e, attempt))
+
+async def _acall_with_retry(fn, *args, **kwargs):
+    """Async variant of _call_with_retry"""
+    import anthropic
+
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        try:
+            return await fn(*args, **kwargs)
+        except anthropic.APIStatusError as e:
+            if not _is_retryable(e) or attempt == RETRY_MAX_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(_retry_delay(e, attempt))
+
+def _extract_json_object(text: str) -> Optional[Dict]:
+    """Layered extraction of a JSON object from model output: direct
+    parse, then a fenced code block, then the outermost brace span.
+    Returns None when no strategy yields a dict."""
+    candidates = [text]
+    fenced = _FENCED_JSON_RE.search(text)
+    if fenced:
+        candidates.append(fenced.group(1))
+    braced = _JSON_OBJECT_RE.search(text)
+    if braced:
+        candidates.append(braced.group(0))
+
+    for candidate in candidates:
+        try:
+            data = orjson.loads(candidate)
+        except orjson.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+# Bound on the semantic validation cache
+VALIDATION_CACHE_MAX_ENTRIES = 256
+
+# Client-side cap on database query wall-clock
+DB_QUERY_TIMEOUT_SECONDS = 30
+RESULT_PREVIEW_ROWS = 1000
+
+@functools.lru_cache(maxsize=256)
+def _canonicalize_sql(query: str) -> str:
+    """Reprints SQL in sqlglot's canonical single-line form, stripping
+    comments and collapsing whitespace, so the same query costs fewer
+    prompt tokens however it was typed. Falls back to whitespace
+    collapsing when the query doesn't parse."""
+    try:
+        return sqlglot.transpile(query, read="postgres", write="postgres", pretty=False, comments=False)[0]
+    except Exception:
+        return " ".join(query.split())
+
+def _validation_cache_key(query: str, industry: str, question: str) -> bytes:
+    # Keyed on the canonical form as-is: sqlglot already normalizes
+    # keyword case, and folding further would collide string literals
+    # of different case into one entry
+    return hashlib.blake2b(
+        f"{industry}|{question}|{_canonicalize_sql(query)}".encode(),
+        digest_size=16
+    ).digest()
+
+@st.cache_resource
+def _validation_cache() -> Dict:
+    """Process-wide LRU of validation results keyed on normalized SQL.
+
+    Shared by every session's script thread, so all access goes through
+    the lock — same pattern as _question_pool."""
+    return {
+        "entries": collections.OrderedDict(),
+        "lock": threading.Lock(),
+    }
+
+# Immutable schema definitions shared by every SQLTrainer instance.
+# Column lists are tuples and the mappings are read-only proxies, so the
+# structure is allocated once at import and safe to share across sessions.
+_INDUSTRY_SCHEMAS: Mapping[str, Mapping] = MappingProxyType({
+    "logistics": MappingProxyType({
+        "schema_url": "https://claude.site/artifacts/98ddf448-03e9-496c-928a-48d0604d4759",
+        "tables": MappingProxyType({
+            "products": ("product_id", "sku", "name", "description", "category", "unit_weight", "unit_volume", "base_price", "minimum_stock", "is_active"),
+            "warehouses": ("warehouse_id", "name", "address", "city", "state", "zip_code", "total_capacity", "temperature_controlled", "operating_hours", "status"),
+            "zones": ("zone_id", "warehouse_id", "zone_name", "zone_type", "capacity", "temperature_range"),
+            "inventory": ("inventory_id", "product_id", "warehouse_id", "zone_id", "quantity", "lot_number", "expiration_date", "last_counted_date"),
+            "suppliers": ("supplier_id", "name", "contact_person", "email", "phone", "address", "payment_terms", "rating", "active"),
+            "purchase_orders": ("po_id", "supplier_id", "warehouse_id", "order_date", "expected_delivery", "status", "total_amount"),
+            "po_items": ("po_item_id", "po_id", "product_id", "quantity", "unit_price"),
+            "employees": ("employee_id", "first_name", "last_name", "email", "phone", "role", "warehouse_id", "hire_date", "certification"),
+            "shipments": ("shipment_id", "warehouse_id", "destination_address", "carrier", "tracking_number", "status", "ship_date", "estimated_delivery", "actual_delivery"),
+            "shipment_items": ("shipment_item_id", "shipment_id", "product_id", "quantity", "picked_by", "picked_from_zone")
+        }),
+        "relationships": (
+            "zones.warehouse_id -> warehouses.warehouse_id",
+            "inventory.product_id -> products.product_id",
+            "inventory.warehouse_id -> warehouses.warehouse_id",
+            "inventory.zone_id -> zones.zone_id",
+            "purchase_orders.supplier_id -> suppliers.supplier_id",
+            "purchase_orders.warehouse_id -> warehouses.warehouse_id",
+            "po_items.po_id -> purchase_orders.po_id",
+            "po_items.product_id -> products.product_id",
+            "employees.warehouse_id -> warehouses.warehouse_id",
+            "shipments.warehouse_id -> warehouses.warehouse_id",
+            "shipment_items.shipment_id -> shipments.shipment_id",
+            "shipment_items.product_id -> products.product_id",
+            "shipment_items.picked_by -> employees.employee_id",
+            "shipment_items.picked_from_zone -> zones.zone_id"
+        )
+    }),
+    "healthcare": MappingProxyType({
+        "schema_url": "https://claude.site/artifacts/96e82497-f107-4e25-97c1-220b727b1c3b",
+        "tables": MappingProxyType({
+            "patients": ("patient_id", "name", "dob", "insurance_id"),
+            "appointments": ("appointment_id", "patient_id", "doctor_id", "date", "status"),
+            "doctors": ("doctor_id", "name", "specialty", "department"),
+            "treatments": ("treatment_id", "patient_id", "doctor_id", "diagnosis", "date")
+        }),
+        "relationships": (
+            "appointments.patient_id -> patients.patient_id",
+            "appointments.doctor_id -> doctors.doctor_id",
+            "treatments.patient_id -> patients.patient_id"
+        )
+    })
+})
+
+def _build_schema_prompt(industry: str) -> str:
+    """Creates a compact, token-lean description of the database schema.
+
+    One table(col,col,...) line per table — bullets, blank lines and
+    padding cost input tokens on every call without adding meaning. The
+    ordering is stable so the bytes stay identical across calls and keep
+    the Anthropic prompt-cache prefix warm.
+    """
+    schema = _INDUSTRY_SCHEMAS[industry]
+
+    parts = [f"{industry.title()} database tables:"]
+    parts.extend(f"{table}({','.join(columns)})" for table, columns in schema["tables"].items())
+    parts.append("Relationships: " + "; ".join(schema["relationships"]))
+    return "\n".join(parts) + "\n"
+
+# The schemas are import-time constants, so the prompt strings are too;
+# byte-stable strings also keep Anthropic prompt-cache keys stable
+_SCHEMA_PROMPTS: Mapping[str, str] = MappingProxyType({
+    industry: _build_schema_prompt(industry) for industry in _INDUSTRY_SCHEMAS
+})
+
+# Hashable, allocated once — st.selectbox gets the same object on every
+# rerun instead of a fresh list
+_INDUSTRY_KEYS: tuple = tuple(_INDUSTRY_SCHEMAS)
+
+def check_password():
+    """Returns `True` if the user had the correct password."""
+
+    def password_entered():
+        """Checks whether a password entered by the user is correct."""
+        if hmac.compare_digest(st.session_state["password"], st.secrets["PASSWORD"]):
+            st.session_state["password_correct"] = True
+            del st.session_state["password"]  # Remove password from session state
+        else:
+            st.session_state["password_correct"] = False
+
+    # First run or password not yet entered
+    if "password_correct" not in st.session_state:
+        st.text_input(
+            "Password", 
+            type="password", 
+            on_change=password_entered, 
+            key="password"
+        )
+        return False
+    
+    # Password already entered and correct
+    elif st.session_state["password_correct"]:
+        return True
+    
+    # Password entered but incorrect
+    else:
+        st.text_input(
+            "Password", 
+            type="password", 
+            on_change=password_entered, 
+            key="password"
+        )
+        st.error("😕 Password incorrect")
+        return False
+
+@st.cache_resource
+def _get_anthropic_clients():
+    """Builds the sync and async Anthropic clients once per process.
+
+    Cached separately from the trainer so the warm connection pools
+    survive even if the trainer cache entry is cleared. HTTP/2
+    multiplexes every Claude call over one kept-alive TCP+TLS
+    connection instead of paying handshakes on cold sockets.
+    """
+    # Deferred so the login screen doesn't pay the anthropic import
+    import anthropic
+
+    limits = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+    timeout = httpx.Timeout(120.0, connect=10.0)
+    client = anthropic.Anthropic(
+        api_key=st.secrets["ANTHROPIC_API_KEY"],
+        http_client=httpx.Client(http2=True, limits=limits, timeout=timeout)
+    )
+    aclient = anthropic.AsyncAnthropic(
+        api_key=st.secrets["ANTHROPIC_API_KEY"],
+        http_client=httpx.AsyncClient(http2=True, limits=limits, timeout=timeout)
+    )
+
+    def _warm_connection():
+        # Cheapest authenticated endpoint: pays the TCP+TLS handshake up
+        # front so the first real Claude call reuses a warm connection.
+        # Best-effort — a failure here just means a cold first call.
+        try:
+            client.messages.count_tokens(
+                model=GENERATION_MODEL,
+                messages=[{"role": "user", "content": "ping"}]
+            )
+        except Exception:
+            pass
+
+    threading.Thread(target=_warm_connection, daemon=True).start()
+    return client, aclient
+
+@st.cache_resource
+def _async_loop() -> asyncio.AbstractEventLoop:
+    """Persistent event loop on a daemon thread for the async client.
+
+    asyncio.run per click would close its loop on return, stranding the
+    cached AsyncClient's keep-alive connections on a dead loop — the
+    next call would then fail with 'Event loop is closed'.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def _run_async(coro):
+    """Runs a coroutine on the persistent loop and waits for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, _async_loop()).result()
+
+@st.cache_resource
+def _get_supabase():
+    """Builds the Supabase client once per process, swapping the
+    PostgREST session for one with explicit keep-alive pool limits so
+    RPC calls reuse a warm connection instead of renegotiating TLS"""
+    from supabase import create_client
+
+    client = create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
+    default_session = client.postgrest.session
+    client.postgrest.session = httpx.Client(
+        base_url=default_session.base_url,
+        headers=default_session.headers,
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+        timeout=httpx.Timeout(30.0, connect=10.0)
+    )
+    return client
+
+class SQLTrainer:
+    def __init__(self):
+        # Check for required secrets
+        required_secrets = ['ANTHROPIC_API_KEY', 'SUPABASE_URL', 'SUPABASE_KEY']
+        missing_secrets = [secret for secret in required_secrets if secret not in st.secrets]
+        if missing_secrets:
+            raise RuntimeError(f"Missing required secrets: {', '.join(missing_secrets)}")
+
+        self.client, self.aclient = _get_anthropic_clients()
+        self.supabase = _get_supabase()
+        self._db_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        self.industry_schemas: Mapping[str, Mapping] = _INDUSTRY_SCHEMAS
+        self.question_topics = {
+        "logistics": {
+            "inventory_analysis": {
+                "focus": ["current stock levels", "reorder points", "product availability", "inventory by warehouse"],
+                "metrics": ["total quantity", "number of products", "storage utilization", "low stock items"]
+            },
+            "warehouse_operations": {
+                "focus": ["zone usage", "warehouse capacity", "temperature controlled storage", "warehouse status"],
+                "metrics": ["total capacity", "available space", "zone distribution", "facility utilization"]
+            },
+            "supplier_insights": {
+                "focus": ["supplier performance", "order status", "delivery tracking", "supplier ratings"],
+                "metrics": ["active suppliers", "pending orders", "order volumes", "supplier ratings"]
+            },
+            "shipping_status": {
+                "focus": ["current shipments", "carrier usage", "delivery performance", "shipping volume"],
+                "metrics": ["active shipments", "items shipped", "shipping capacity", "delivery status"]
+            }
+        }
+    }
+    def get_schema_prompt(self, industry: str) -> str:
+        """Returns the precomputed schema prompt for the industry"""
+        return _SCHEMA_PROMPTS.get(industry, "Industry not found")
+
+    def _build_question_prompt(self, industry: str) -> str:
+        """Builds the question-generation task prompt with a randomly
+        chosen topic, focus and metric for the industry"""
+        topic = random.choice(list(self.question_topics[industry].keys()))
+        topic_details = self.question_topics[industry][topic]
+
+        return textwrap.dedent(f"""
+            You are a business stakeholder in the {industry} industry who needs data for analysis.
+            Generate ONE business question that can be answered with SQL.
+            
+            Topic area: {topic}
+            Focus on: {random.choice(topic_details['focus'])}
+            Key metric: {random.choice(topic_details['metrics'])}
+            
+            Requirements:
+            - Question must be specific and actionable
+            - Query should require at most 1 JOIN
+            - Can use basic aggregations (SUM, COUNT, MIN, MAX)
+            - Must be answerable using the schema provided
+            - Focus on practical business insights
+            
+            Format your response as:
+            "I need a report showing [specific metric] for [specific business purpose]."
+        """).strip()
+
+    def generate_stakeholder_question(self, industry: str, placeholder=None) -> str:
+        """Generates a business question using Claude"""
+        if industry not in self.question_topics:
+            return "Industry not supported for question generation"
+
+        return self._stream_completion(
+            model=GENERATION_MODEL,
+            max_tokens=GENERATION_MAX_TOKENS,
+            temperature=0.7,
+            system="You are a business stakeholder asking for data.",
+            schema_prompt=self.get_schema_prompt(industry),
+            prompt=self._build_question_prompt(industry),
+            placeholder=placeholder
+        )
+
+    def generate_stakeholder_questions(self, industry: str, n: int = 5) -> List[str]:
+        """Generates n distinct questions in a single Claude call.
+
+        The schema prefill is paid once instead of n times, so this is
+        the cheap way to fill a queue; per-click generation still uses
+        the single-question path for variety.
+        """
+        if industry not in self.question_topics:
+            return []
+
+        prompt = self._build_question_prompt(industry) + textwrap.dedent(f"""
+
+            Instead of one question, generate {n} DISTINCT questions covering
+            different topic areas of the schema, numbered 1 to {n}, one per line.
+        """).rstrip()
+
+        response = self._stream_completion(
+            model=GENERATION_MODEL,
+            max_tokens=GENERATION_MAX_TOKENS * n,
+            temperature=0.7,
+            system="You are a business stakeholder asking for data.",
+            schema_prompt=self.get_schema_prompt(industry),
+            prompt=prompt
+        )
+        return [match.strip() for match in _NUMBERED_LINE_RE.findall(response)]
+
+    async def generate_stakeholder_question_async(self, industry: str) -> str:
+        """Async variant of generate_stakeholder_question, used to
+        prefetch the next question while other calls are in flight"""
+        if industry not in self.question_topics:
+            return "Industry not supported for question generation"
+
+        return await self._acomplete(
+            model=GENERATION_MODEL,
+            max_tokens=GENERATION_MAX_TOKENS,
+            temperature=0.7,
+            system="You are a business stakeholder asking for data.",
+            schema_prompt=self.get_schema_prompt(industry),
+            prompt=self._build_question_prompt(industry)
+        )
+
+    async def _acomplete(self, model: str, max_tokens: int, temperature: float,
+                         system: str, schema_prompt: str, prompt: str,
+                         prefill: Optional[str] = None,
+                         stop_sequences: Optional[List[str]] = None) -> str:
+        """Non-streaming async completion with the same cached-schema
+        message layout as _stream_completion"""
+        response = await _acall_with_retry(
+            self.aclient.messages.create,
+            **self._request_params(model, max_tokens, temperature, system,
+                                   schema_prompt, prompt, prefill, stop_sequences)
+        )
+        return response.content[0].text
+
+    def _request_params(self, model: str, max_tokens: int, temperature: float,
+                        system: str, schema_prompt: str, prompt: str,
+                        prefill: Optional[str] = None,
+                        stop_sequences: Optional[List[str]] = None,
+                        tool: Optional[Dict] = None) -> Dict:
+        """Shared messages.create kwargs with the schema in its own
+        prompt-cached content block. An optional assistant prefill makes
+        the model continue mid-response (e.g. mid-JSON) instead of
+        spending tokens on preamble."""
+        params = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            # The stable role + schema preamble lives in system blocks,
+            # with the schema marked for Anthropic's prompt cache; only
+            # the small per-call user message is billed at full rate
+            "system": [
+                {
+                    "type": "text",
+                    "text": system
+                },
+                {
+                    "type": "text",
+                    "text": schema_prompt,
+                    "cache_control": {"type": "ephemeral"}
+                }
+            ],
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        }
+        if prefill:
+            params["messages"].append({"role": "assistant", "content": prefill})
+        if stop_sequences:
+            params["stop_sequences"] = stop_sequences
+        if tool:
+            params["tools"] = [tool]
+            params["tool_choice"] = {"type": "tool", "name": tool["name"]}
+        return params
+
+    def batch_generate_questions(self, industry: str, n: int) -> List[str]:
+        """Pre-generates a pool of stakeholder questions through the
+        Message Batches API, which halves token cost on this
+        non-latency-sensitive path. Blocks until the batch completes,
+        so call it from a background thread."""
+        if industry not in self.question_topics:
+            return []
+
+        batch = _call_with_retry(
+            self.client.messages.batches.create,
+            requests=[
+                {
+                    "custom_id": f"question-{i}",
+                    "params": self._request_params(
+                        model=GENERATION_MODEL,
+                        max_tokens=GENERATION_MAX_TOKENS,
+                        temperature=0.7,
+                        system="You are a business stakeholder asking for data.",
+                        schema_prompt=self.get_schema_prompt(industry),
+                        prompt=self._build_question_prompt(industry)
+                    )
+                }
+                for i in range(n)
+            ]
+        )
+        while True:
+            batch = self.client.messages.batches.retrieve(batch.id)
+            if batch.processing_status == "ended":
+                break
+            time.sleep(5)
+
+        return [
+            result.result.message.content[0].text
+            for result in self.client.messages.batches.results(batch.id)
+            if result.result.type == "succeeded"
+        ]
+
+    def _stream_completion(self, model: str, max_tokens: int, temperature: float,
+                           system: str, schema_prompt: str, prompt: str,
+                           placeholder=None, prefill: Optional[str] = None,
+                           stop_sequences: Optional[List[str]] = None) -> str:
+        """Streams a completion from Claude, rendering tokens into the
+        given Streamlit placeholder as they arrive so the user sees
+        first-token latency instead of full-completion latency.
+
+        The schema prompt goes into its own content block marked with
+        cache_control so Anthropic's prompt cache reuses the processed
+        schema tokens across calls for the same industry.
+        """
+        def _attempt() -> str:
+            buffer = ""
+            with self.client.messages.stream(
+                **self._request_params(model, max_tokens, temperature, system,
+                                       schema_prompt, prompt, prefill, stop_sequences)
+            ) as stream:
+                for text in stream.text_stream:
+                    buffer += text
+                    if placeholder is not None:
+                        placeholder.markdown(buffer)
+            return buffer
+
+        # Rate-limit rejections surface when the stream opens, before
+        # any tokens render, so retrying the whole attempt is safe
+        return _call_with_retry(_attempt)
+
+    def _build_validation_prompt(self, query: str, question: str) -> str:
+        """Builds the validation task prompt for a submitted query"""
+        # Dedent the template before interpolating: a multi-line query
+        # would otherwise defeat the common-prefix detection
+        template = textwrap.dedent("""
+        The stakeholder asked: "{question}"
+
+        The user provided this SQL query:
+        {query}
+
+        Analyze whether this query correctly answers the question (PostgreSQL syntax)
+        and report your verdict with the report_validation tool.
+        """).strip()
+        return template.format(question=question, query=query)
+
+    def _validation_max_tokens(self, industry: str, prompt: str) -> int:
+        """Sizes the decode budget to what the prompt leaves room for.
+
+        A flat allowance over-reserves output for short queries; estimating
+        the prompt side keeps schema + query + feedback inside the context
+        budget without an extra token-counting API call.
+        """
+        prompt_tokens = _approx_tokens(self.get_schema_prompt(industry)) + _approx_tokens(prompt)
+        return max(100, min(VALIDATION_MAX_TOKENS, VALIDATION_CONTEXT_BUDGET - prompt_tokens))
+
+    def _reject_locally(self, query: str, industry: str) -> Optional[Dict]:
+        """Catches obviously wrong submissions locally so they don't
+        cost a Claude round-trip: non-SQL text, queries PostgreSQL
+        can't parse, and queries that touch no table in the industry's
+        schema."""
+        if len(query.strip()) < 10 or not _BASIC_SQL_RE.search(query):
+            return {
+                "is_correct": False,
+                "feedback": "That doesn't look like a complete SQL query — it needs at least a SELECT ... FROM clause.",
+                "hint": "Start with SELECT <columns> FROM <table>.",
+                "correct_query": query
+            }
+
+        try:
+            parsed = sqlglot.parse_one(query, read="postgres")
+        except sqlglot.errors.SqlglotError:
+            return {
+                "is_correct": False,
+                "feedback": "The query couldn't be parsed as PostgreSQL — check for typos or unbalanced parentheses.",
+                "hint": "Fix the syntax error before worrying about the logic.",
+                "correct_query": query
+            }
+
+        if parsed is not None:
+            tables = {t.name for t in parsed.find_all(sqlglot.exp.Table)}
+            known = set(self.industry_schemas[industry]["tables"])
+            if tables and tables.isdisjoint(known):
+                return {
+                    "is_correct": False,
+                    "feedback": f"The query only references tables that don't exist in the {industry} schema: {', '.join(sorted(tables))}.",
+                    "hint": "Check the schema panel for the available table names.",
+                    "correct_query": query
+                }
+        return None
+
+    def validate_sql(self, query: str, industry: str, question: str) -> Dict:
+        """Validates the SQL query using Claude"""
+        rejection = self._reject_locally(query, industry)
+        if rejection is not None:
+            return rejection
+        prompt = self._build_validation_prompt(query, question)
+        response = _call_with_retry(
+            self.client.messages.create,
+            **self._request_params(
+                model=VALIDATION_MODEL,
+                max_tokens=self._validation_max_tokens(industry, prompt),
+                temperature=0,
+                system="You are a SQL expert providing feedback.",
+                schema_prompt=self.get_schema_prompt(industry),
+                prompt=prompt,
+                tool=_VALIDATION_TOOL
+            )
+        )
+        return self._feedback_from_tool_use(response, query)
+
+    async def validate_sql_async(self, query: str, industry: str, question: str) -> Dict:
+        """Async variant of validate_sql"""
+        rejection = self._reject_locally(query, industry)
+        if rejection is not None:
+            return rejection
+        prompt = self._build_validation_prompt(query, question)
+        response = await _acall_with_retry(
+            self.aclient.messages.create,
+            **self._request_params(
+                model=VALIDATION_MODEL,
+                max_tokens=self._validation_max_tokens(industry, prompt),
+                temperature=0,
+                system="You are a SQL expert providing feedback.",
+                schema_prompt=self.get_schema_prompt(industry),
+                prompt=prompt,
+                tool=_VALIDATION_TOOL
+            )
+        )
+        return self._feedback_from_tool_use(response, query)
+
+    def _feedback_from_tool_use(self, response, query: str) -> Dict:
+        """Reads the verdict from the forced tool call's input dict.
+
+        tool_choice guarantees a tool_use block in practice; if the
+        model somehow answered in prose, fall back to the text parser.
+        """
+        for block in response.content:
+            if block.type == "tool_use":
+                data = block.input
+                return {
+                    "is_correct": bool(data.get("is_correct")),
+                    "feedback": data.get("feedback", "No feedback returned"),
+                    "hint": data.get("hint", ""),
+                    "correct_query": data.get("correct_query") or query
+                }
+        return self._parse_validation_feedback(response.content[0].text, query)
+
+    def validate_sql_batch(self, queries: List[str], industry: str, question: str) -> List[Dict]:
+        """Validates several candidate queries in one Claude call.
+
+        The schema/question prefix is paid once for the whole set
+        instead of once per query, so grading N attempts costs one
+        prefill plus N short verdicts.
+        """
+        if not queries:
+            return []
+
+        numbered = "\n".join(f"{i + 1}. {q}" for i, q in enumerate(queries))
+        template = textwrap.dedent("""
+        The stakeholder asked: "{question}"
+
+        The user provided these candidate SQL queries:
+        {numbered}
+
+        Analyze whether each query correctly answers the question (PostgreSQL syntax).
+
+        Respond with ONLY a JSON array, one object per query in the same order, each in this form:
+        {{"is_correct": true/false, "feedback": "what's right or wrong", "hint": "hint if the query needs improvement, else empty", "correct_query": "the correct query if the user's query is wrong, else empty"}}
+        """).strip()
+
+        response = self._stream_completion(
+            model=VALIDATION_MODEL,
+            max_tokens=VALIDATION_MAX_TOKENS * len(queries),
+            temperature=0,
+            system="You are a SQL expert providing feedback.",
+            schema_prompt=self.get_schema_prompt(industry),
+            prompt=template.format(question=question, numbered=numbered),
+            prefill="[",
+            stop_sequences=["```"]
+        )
+
+        try:
+            parsed = orjson.loads("[" + response)
+        except orjson.JSONDecodeError:
+            parsed = []
+
+        results = []
+        for i, query in enumerate(queries):
+            item = parsed[i] if i < len(parsed) and isinstance(parsed[i], dict) else {}
+            results.append({
+                "is_correct": bool(item.get("is_correct")),
+                "feedback": item.get("feedback", "No feedback returned"),
+                "hint": item.get("hint", ""),
+                "correct_query": item.get("correct_query") or query
+            })
+        return results
+
+    def validate_and_execute(self, query: str, industry: str, question: str):
+        """Validates the query with Claude and executes it against the
+        database concurrently, so the user pays max(validation, query)
+        instead of their sum. Returns (feedback, result).
+        """
+        async def _gathered():
+            return await asyncio.gather(
+                self.validate_sql_async(query, industry, question),
+                asyncio.to_thread(self.execute_query, query)
+            )
+
+        return _run_async(_gathered())
+
+    def validate_and_prefetch(self, query: str, industry: str, question: str):
+        """Validates the submitted query and prefetches the next
+        stakeholder question concurrently, hiding one full Anthropic
+        round-trip behind the other. Returns (feedback, next_question).
+        """
+        async def _gathered():
+            return await asyncio.gather(
+                self.validate_sql_async(query, industry, question),
+                self.generate_stakeholder_question_async(industry)
+            )
+
+        return _run_async(_gathered())
+
+    def _parse_validation_feedback(self, feedback: str, query: str) -> Dict:
+        # Parse the JSON response, salvaging objects wrapped in stray
+        # prose or code fences so a mostly-good response doesn't cost a
+        # wasted API call
+        data = _extract_json_object(feedback)
+
+        if data is None:
+            # Legacy fallback when the model ignores the JSON format
+            is_correct = "yes" in feedback.lower().split("\n")[0]
+            return {
+                "is_correct": is_correct,
+                "feedback": feedback,
+                "hint": feedback if not is_correct else "",
+                "correct_query": feedback if not is_correct else query
+            }
+
+        return {
+            "is_correct": bool(data.get("is_correct")),
+            "feedback": data.get("feedback", feedback),
+            "hint": data.get("hint", ""),
+            "correct_query": data.get("correct_query") or query
+        }
+
+
+    def execute_query(self, query: str) -> Dict:
+        """Executes the SQL query against Supabase database.
+
+        The RPC runs on a worker thread with a hard timeout so a
+        runaway query surfaces as an error instead of hanging the
+        Streamlit session."""
+        future = self._db_executor.submit(self._do_query, query)
+        try:
+            return future.result(timeout=DB_QUERY_TIMEOUT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            return {
+                "success": False,
+                "data": None,
+                "error": f"Query timed out after {DB_QUERY_TIMEOUT_SECONDS} seconds"
+            }
+
+    def _do_query(self, query: str) -> Dict:
+        try:
+            # Remove trailing semicolon and whitespace
+            cleaned_query = query.strip().rstrip(';')
+
+            result = self.supabase.rpc('execute_query', {'query_text': cleaned_query}).execute()
+            return {
+                "success": True,
+                "data": result.data,
+                "error": None
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "data": None,
+                "error": str(e)
+            }
+
+@st.cache_resource
+def get_trainer() -> "SQLTrainer":
+    """Builds the trainer once per process so the Anthropic and Supabase
+    clients (and their connection pools) survive Streamlit reruns."""
+    return SQLTrainer()
+
+def _render_query_results(rows: List[Dict]):
+    """Renders query rows as an Arrow table.
+
+    Building the table with pyarrow directly skips pandas' row-by-row
+    dtype inference — st.dataframe accepts Arrow natively. Results
+    larger than the preview limit are truncated on screen with a CSV
+    download for the full set.
+    """
+    st.write("### Query Results")
+    if not rows:
+        st.info("Query returned no rows")
+        return
+    table = pa.Table.from_pylist(rows)
+    if table.num_rows > RESULT_PREVIEW_ROWS:
+        st.caption(f"Showing first {RESULT_PREVIEW_ROWS} of {table.num_rows} rows")
+        st.dataframe(table.slice(0, RESULT_PREVIEW_ROWS), use_container_width=True)
+        buffer = io.BytesIO()
+        pyarrow.csv.write_csv(table, buffer)
+        st.download_button("Download full CSV 📥", buffer.getvalue(), "query_results.csv", "text/csv")
+    else:
+        st.dataframe(table, use_container_width=True)
+
+class QueryExecutionError(Exception):
+    """Raised inside the cached execution wrapper so failures are never
+    stored as cache entries"""
+
+@st.cache_data(ttl=300, max_entries=64, show_spinner=False)
+def execute_query_cached(canonical_query: str) -> Dict:
+    """Serves repeated identical queries from memory for five minutes.
+
+    Keyed on the canonicalized SQL so whitespace and comment variants
+    collide. Only successful results are cached — failures raise so
+    Streamlit discards them and the next attempt re-executes.
+    """
+    result = get_trainer().execute_query(canonical_query)
+    if not result["success"]:
+        raise QueryExecutionError(result["error"])
+    return result
+
+@st.cache_resource
+def _question_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Shared executor for warming up questions in the background"""
+    return concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+@st.cache_resource
+def _question_pool() -> Dict:
+    """Process-wide pool of pre-generated questions per industry"""
+    return {
+        "questions": collections.defaultdict(collections.deque),
+        "refilling": set(),
+        "lock": threading.Lock(),
+    }
+
+def _refill_question_pool(industry: str) -> None:
+    """Background refill of the question pool via the Batch API"""
+    pool = _question_pool()
+    with pool["lock"]:
+        if industry in pool["refilling"]:
+            return
+        pool["refilling"].add(industry)
+    try:
+        questions = get_trainer().batch_generate_questions(industry, QUESTION_POOL_SIZE)
+        with pool["lock"]:
+            pool["questions"][industry].extend(questions)
+    except Exception:
+        pass  # Pool refill is best-effort; the live path still works
+    finally:
+        with pool["lock"]:
+            pool["refilling"].discard(industry)
+
+def next_pooled_question(industry: str) -> Optional[str]:
+    """Pops a pre-generated question if one is available, kicking off a
+    background refill when the pool runs low"""
+    pool = _question_pool()
+    with pool["lock"]:
+        queue = pool["questions"][industry]
+        question = queue.popleft() if queue else None
+        needs_refill = len(queue) < QUESTION_POOL_REFILL_AT and industry not in pool["refilling"]
+    if needs_refill:
+        threading.Thread(target=_refill_question_pool, args=(industry,), daemon=True).start()
+    return question
+
+@st.cache_data(show_spinner=False)
+def generate_question_cached(industry: str, nonce: int, _placeholder=None) -> str:
+    """Caches generated questions per (industry, nonce).
+
+    The nonce comes from session state and is bumped on every
+    "Get New Question" click, so users still get fresh questions while
+    reruns with the same nonce skip the Anthropic round-trip. The
+    placeholder is underscore-prefixed so Streamlit leaves it out of
+    the cache key.
+    """
+    return get_trainer().generate_stakeholder_question(industry, placeholder=_placeholder)
+
+@st.cache_resource
+def _question_store() -> Dict[str, str]:
+    """Process-wide qid -> question text map backing the URL param."""
+    return {}
+
+def _remember_question(question: str) -> None:
+    """Pins the current question in the URL so a hard refresh restores
+    it from the local store instead of paying a generation call"""
+    qid = hashlib.blake2b(question.encode(), digest_size=8).hexdigest()
+    _question_store()[qid] = question
+    st.query_params["q"] = qid
+
+def _restore_question() -> Optional[str]:
+    qid = st.query_params.get("q")
+    return _question_store().get(qid) if qid else None
+
+
+@st.fragment
+def _query_panel(trainer):
+    """Question display plus the SQL form and its handlers.
+
+    Runs as a fragment so form submits and new-question clicks
+    rerun only this panel instead of the whole script.
+    """
+    # Generate new question with loading spinner
+    want_new_question = st.button("Get New Question 🎯")
+
+    st.write("### Question 📋")
+    question_slot = st.empty()
+
+    if want_new_question and st.session_state.get("next_question"):
+        # A question was prefetched during the last validation —
+        # serve it instantly instead of calling the API
+        st.session_state.current_question = st.session_state.next_question
+        st.session_state.next_question = None
+        _remember_question(st.session_state.current_question)
+    elif want_new_question or not st.session_state.current_question:
+        question = None
+
+        # After a hard refresh the session is empty but the URL
+        # still carries the question id — restore it for free
+        if not want_new_question:
+            question = _restore_question()
+
+        # A think-time prefetch may have finished while the user
+        # typed; serve it without blocking if it's ready
+        if question is None:
+            future = st.session_state.get("prefetch_future")
+            if future is not None and future.done():
+                st.session_state.prefetch_future = None
+                try:
+                    question = future.result()
+                except Exception:
+                    pass
+
+        if question is None:
+            # Questions warmed up at industry selection come first
+            queue = st.session_state.setdefault("question_queue", [])
+            if not queue:
+                futures = st.session_state.get("question_futures") or []
+                if futures:
+                    try:
+                        with st.spinner('Generating new question... 🤔'):
+                            queue.extend(futures.pop(0).result(timeout=30))
+                    except Exception:
+                        pass
+            if queue:
+                question = queue.pop(0)
+
+        if question is None:
+            question = next_pooled_question(st.session_state.industry)
+        if question is None:
+            st.session_state.question_nonce += 1
+            question = generate_question_cached(
+                st.session_state.industry,
+                st.session_state.question_nonce,
+                _placeholder=question_slot
+            )
+        st.session_state.current_question = question
+        _remember_question(question)
+
+    question_slot.info(st.session_state.current_question)
+
+    # Kick off the next question while the user is thinking, so
+    # the next click is served from a finished future even when
+    # the warmup queue and pool are dry
+    if (not st.session_state.get("next_question")
+            and st.session_state.get("prefetch_future") is None):
+        st.session_state.prefetch_future = _question_executor().submit(
+            trainer.generate_stakeholder_question,
+            st.session_state.industry
+        )
+    
+    # SQL input — inside a form so edits don't trigger reruns;
+    # the script only reruns when one of the submit buttons fires
+    with st.form("sql_form"):
+        user_query = st.text_area("Your SQL Query: ⌨️", height=150)
+
+        # Create three columns for the buttons
+        button_col1, button_col2, button_col3 = st.columns(3)
+
+        with button_col1:
+            validate_clicked = st.form_submit_button("Submit for Validation 🔍")
+
+        with button_col2:
+            run_clicked = st.form_submit_button("Query Database 📊")
+
+        with button_col3:
+            both_clicked = st.form_submit_button("Validate & Run 🚀")
+
+    if validate_clicked and user_query:
+        # Semantically identical resubmissions (whitespace/case
+        # variants included) skip the Anthropic round-trip; the
+        # canonical form is also what goes into the prompt
+        canonical_query = _canonicalize_sql(user_query)
+        cache = _validation_cache()
+        cache_key = _validation_cache_key(
+            canonical_query,
+            st.session_state.industry,
+            st.session_state.current_question
+        )
+        with cache["lock"]:
+            feedback = cache["entries"].get(cache_key)
+            if feedback is not None:
+                cache["entries"].move_to_end(cache_key)
+
+        if feedback is None:
+            with st.spinner('Analyzing your SQL code... 🔍'):
+                feedback, st.session_state.next_question = trainer.validate_and_prefetch(
+                    canonical_query,
+                    st.session_state.industry,
+                    st.session_state.current_question
+                )
+            with cache["lock"]:
+                cache["entries"][cache_key] = feedback
+                if len(cache["entries"]) > VALIDATION_CACHE_MAX_ENTRIES:
+                    cache["entries"].popitem(last=False)
+
+        if feedback["is_correct"]:
+            st.success("🎉 " + feedback["feedback"])
+        else:
+            st.error("❌ " + feedback["feedback"])
+
+    if run_clicked and user_query:
+        with st.spinner('Executing query... 🔄'):
+            try:
+                result = execute_query_cached(_canonicalize_sql(user_query))
+                _render_query_results(result["data"])
+            except QueryExecutionError as e:
+                st.error(f"Query Error: {e}")
+
+    if both_clicked and user_query:
+        with st.spinner('Validating and executing... 🔄'):
+            feedback, result = trainer.validate_and_execute(
+                _canonicalize_sql(user_query),
+                st.session_state.industry,
+                st.session_state.current_question
+            )
+
+        if feedback["is_correct"]:
+            st.success("🎉 " + feedback["feedback"])
+        else:
+            st.error("❌ " + feedback["feedback"])
+
+        if result["success"]:
+            _render_query_results(result["data"])
+        else:
+            st.error(f"Query Error: {result['error']}")
+
+@st.fragment
+def _help_panel(trainer):
+    """Static help column; Change Industry escalates to a full
+    rerun via st.rerun, everything else stays fragment-local"""
+    st.header("Help")
+    
+    # Change Industry button
+    if st.button("Change Industry 🔄"):
+        st.session_state.industry = None
+        st.session_state.current_question = None
+        st.rerun()
+    
+    # Add link button to view schema URL in new tab
+    schema_url = trainer.industry_schemas[st.session_state.industry]["schema_url"]
+    st.link_button("View Database Schema 📊", schema_url)
+    
+    st.write("### Tips 💡")
+    st.write(TIPS_MD)
+
+
+def main():
+    st.set_page_config(layout="wide")
+
+    if not check_password():
+        st.stop()  # Do not continue if check_password is False
+
+    try:
+        trainer = get_trainer()
+    except RuntimeError as e:
+        st.error(f"Error: {str(e)}")
+        return
+
+    # With auto-gc disabled, sweep cycles every N reruns so reference
+    # cycles from dead sessions don't accumulate indefinitely
+    st.session_state.rerun_count = st.session_state.get("rerun_count", 0) + 1
+    if st.session_state.rerun_count % GC_COLLECT_EVERY_N_RERUNS == 0:
+        gc.collect()
+    
+    # Initialize session state
+    if 'industry' not in st.session_state:
+        st.session_state.industry = None
+        st.session_state.current_question = None
+        st.session_state.question_nonce = 0
+    
+    st.title("SQL Trainer")
+    
+    # Industry selection (only shown at start)
+    if not st.session_state.industry:
+        st.header("Select Industry 🏭")
+        industry = st.selectbox(
+            "What industry do you work in?",
+            _INDUSTRY_KEYS
+        )
+        if st.button("Start Training ▶️"):
+            st.session_state.industry = industry
+            # Warm up a small question queue in the background so the
+            # training screen renders with (near) zero wait; one call
+            # returns several questions with the schema prefix paid once
+            st.session_state.question_futures = [
+                _question_executor().submit(trainer.generate_stakeholder_questions, industry, 5)
+            ]
+            st.rerun()
+    else:
+        col1, col2 = st.columns([2, 1])
+
+        with col1:
+            _query_panel(trainer)
+
+        with col2:
+            _help_panel(trainer)
+
+if __name__ == "__main__":
+    main()